@@ -0,0 +1,144 @@
+import csv
+import io
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+import pandas as pd
+from sqlalchemy.engine import Connection, Engine
+
+# Pipeline settings.
+CHUNK_SIZE = 4 * 1024 * 1024
+MAX_PENDING_CHUNKS = 8
+WRITE_QUEUE_SIZE = 4
+
+# Marks the end of the batch stream for the writer thread.
+_DONE = object()
+
+
+def chunk_ranges(file: str, chunk_size: int = CHUNK_SIZE) -> Tuple[List[str], List[Tuple[int, int]]]:
+    """
+    Split a csv file into byte ranges that start and end on line boundaries. Assumes no field contains a newline.
+    :param file: path to csv file with a header row.
+    :param chunk_size: approximate number of bytes per range.
+    :return: (column names from the header, list of (start, end) byte offsets).
+    """
+    size = os.path.getsize(file)
+    ranges = []
+    with open(file, 'rb') as f:
+        header = next(csv.reader([f.readline().decode("utf-8-sig")]))
+        start = f.tell()
+        while start < size:
+            f.seek(min(start + chunk_size, size))
+            f.readline()
+            end = min(f.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return header, ranges
+
+
+def _parse_range(file: str, names: List[str], start: int, end: int,
+                 parse_fn: Callable[[pd.DataFrame], pd.DataFrame]) -> pd.DataFrame:
+    """
+    Read one byte range of a csv file and parse it into a typed batch. Runs inside a worker process.
+    """
+    with open(file, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    raw = pd.read_csv(io.BytesIO(data), header=None, names=names, dtype=str, keep_default_na=False,
+                      encoding="utf-8")
+    return parse_fn(raw)
+
+
+def parse_chunks(file: str, parse_fn: Callable[[pd.DataFrame], pd.DataFrame], workers: Optional[int] = None,
+                 chunk_size: int = CHUNK_SIZE, max_pending: int = MAX_PENDING_CHUNKS) -> Iterator[pd.DataFrame]:
+    """
+    Parse a csv file in parallel, yielding typed batches in file order.
+    At most max_pending chunks are in flight, so a slow consumer holds back the reader and workers.
+    :param file: path to csv file with a header row.
+    :param parse_fn: module-level function turning a DataFrame of raw strings into a typed batch.
+    :param workers: number of worker processes, defaults to the number of cores.
+    :param chunk_size: approximate number of bytes per chunk.
+    :param max_pending: maximum number of chunks submitted but not yet consumed.
+    :return: iterator of typed batches.
+    """
+    names, ranges = chunk_ranges(file, chunk_size)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for start, end in ranges:
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+            pending.append(pool.submit(_parse_range, file, names, start, end, parse_fn))
+        while pending:
+            yield pending.popleft().result()
+
+
+def write_batches(batches: Iterable[pd.DataFrame], write_fn: Callable[[Connection, pd.DataFrame], None], engine: Engine,
+                  queue_size: int = WRITE_QUEUE_SIZE) -> int:
+    """
+    Hand batches to a single writer thread through a bounded queue. Producing blocks while the queue is full.
+    The writer thread opens its own connection, since DBAPI connections are not always usable across threads.
+    :param batches: iterable of typed batches.
+    :param write_fn: function that bulk inserts one batch using the given connection.
+    :param engine: engine the writer connection is opened from (e.g. connection.engine).
+    :param queue_size: maximum number of batches waiting to be written.
+    :return: number of rows written.
+    """
+    batch_queue = queue.Queue(maxsize=queue_size)
+    errors = []
+    written = [0]
+
+    def writer() -> None:
+        try:
+            connection = engine.connect()
+        except Exception as e:
+            errors.append(e)
+            connection = None
+
+        while True:
+            batch = batch_queue.get()
+            if batch is _DONE:
+                break
+            if errors:
+                continue
+            try:
+                write_fn(connection, batch)
+                written[0] += len(batch)
+            except Exception as e:
+                errors.append(e)
+
+        if connection is not None:
+            connection.close()
+
+    thread = threading.Thread(target=writer, daemon=True)
+    thread.start()
+    try:
+        for batch in batches:
+            if errors:
+                break
+            if len(batch):
+                batch_queue.put(batch)
+    finally:
+        batch_queue.put(_DONE)
+        thread.join()
+
+    if errors:
+        raise errors[0]
+    return written[0]
+
+
+def ingest_csv(file: str, parse_fn: Callable[[pd.DataFrame], pd.DataFrame],
+               write_fn: Callable[[Connection, pd.DataFrame], None], engine: Engine, workers: Optional[int] = None) -> int:
+    """
+    Stream a csv file through the parallel parsers into a single writer.
+    :param file: path to csv file with a header row.
+    :param parse_fn: module-level function turning a DataFrame of raw strings into a typed batch.
+    :param write_fn: function that bulk inserts one batch using the given connection.
+    :param engine: engine the writer connection is opened from (e.g. connection.engine).
+    :param workers: number of worker processes, defaults to the number of cores.
+    :return: number of rows written.
+    """
+    return write_batches(parse_chunks(file, parse_fn, workers), write_fn, engine)
@@ -1,13 +1,20 @@
 from os import path
-import csv
+import numpy as np
 import pandas as pd
 from sqlalchemy import Table, Column, Integer, String, ForeignKey, Text, Float, select
-from typing import Set
+from typing import Dict, Iterable, Iterator, Optional, Set
+
+from db.ingest import ingest_csv, parse_chunks, write_batches
+from web_scraping.anime_info_parser import CSV_COLUMNS, normalize_anime_data, to_db_rows
 
 # Define file locations.
 ANIME_DATA_F = "../web_scraping/csv_output/anime_data.csv"
 USER_DATA_F = "../web_scraping/csv_output/user_data.csv"
 
+# Watch statuses counted towards a valid user, and how many of them are required.
+VALID_STATUSES = ["watching", "completed", "dropped", "onhold"]
+MIN_VALID_STATUSES = 2
+
 def create_tables(engine, meta_data) -> None:
     """
     Create necessary tables to store scraped data.
@@ -43,41 +50,51 @@ def create_tables(engine, meta_data) -> None:
 
     meta_data.create_all(engine)
 
-def add_anime_data(connection, meta_data) -> None:
+def parse_anime_chunk(raw: pd.DataFrame) -> pd.DataFrame:
+    """
+    Parse a chunk of ANIME_DATA_F into typed anime_data columns.
+    :param raw: DataFrame of raw strings with the headers of ANIME_DATA_F.
+    :return: typed DataFrame as returned by normalize_anime_data.
+    """
+    return normalize_anime_data(raw.rename(columns=CSV_COLUMNS))
+
+
+def parse_user_chunk(raw: pd.DataFrame) -> pd.DataFrame:
+    """
+    Parse a chunk of USER_DATA_F into typed columns.
+    :param raw: DataFrame of raw strings with the headers of USER_DATA_F.
+    :return: DataFrame with USERNAME, ANIME_TITLE, SCORE, CURR_EPISODE and WATCH_STATUS columns.
+    """
+    return pd.DataFrame({"USERNAME": raw["Username"].astype("string"),
+                         "ANIME_TITLE": raw["Anime_Title"].astype("string"),
+                         "SCORE": pd.to_numeric(raw["Score"], errors="coerce").astype("Float64").round().astype("Int64"),
+                         "CURR_EPISODE": pd.to_numeric(raw["Watch_Progress"], errors="coerce").astype("Int64"),
+                         "WATCH_STATUS": raw["Watch_Status"].astype("string")})
+
+
+def add_anime_data(connection, meta_data, workers: Optional[int] = None) -> None:
     """
     Push data from ANIME_DATA_F to relevant database table.
     :param connection: connection object returned from connection.py
     :param meta_data: metadata object returned from connection.py
+    :param workers: number of parser processes, defaults to the number of cores.
     :return: None
     """
     anime_data_table = meta_data.tables["anime_data"]
 
     if path.exists(ANIME_DATA_F):
-        with open(ANIME_DATA_F, 'r', encoding='UTF8') as f:
-            reader = csv.reader(f)
-            header = next(reader)
-
-            # Scan through each row and parse/cast appropriately.
-            for row in reader:
-                print(row)
-                entry = {"ANIME_TITLE": row[0], "ANIME_SHOW_TYPE": row[1], "ANIME_PREMIERED": row[3],
-                         "ANIME_STUDIOS": row[4], "ANIME_SOURCE": row[5], "ANIME_GENRES": row[6],
-                         "ANIME_THEMES": row[7], "ANIME_AGE_RATING": row[8], "ANIME_SCORE": float(row[9]),
-                         "ANIME_RANKING": int(row[10]), "ANIME_POPULARITY": int(row[11])}
-
-                if row[2] != "Unknown":
-                    entry["ANIME_EPISODES"] = int(row[2])
-
-                connection.execute(anime_data_table.insert(), entry)
+        # Chunks are parsed in parallel and bulk inserted in file order by a single writer.
+        ingest_csv(ANIME_DATA_F, parse_anime_chunk,
+                   lambda conn, batch: conn.execute(anime_data_table.insert(), to_db_rows(batch)),
+                   connection.engine, workers)
 
-            f.close()
 
-
-def add_user_data(connection, meta_data) -> None:
+def add_user_data(connection, meta_data, workers: Optional[int] = None) -> None:
     """
     Push data from USER_DATA_F to relevant database tables.
     :param connection: connection object returned from connection.py
     :param meta_data: metadata object returned from connection.py
+    :param workers: number of parser processes, defaults to the number of cores.
     :return: None
     """
 
@@ -86,82 +103,84 @@ def add_user_data(connection, meta_data) -> None:
     anime_data_table = meta_data.tables["anime_data"]
 
     if path.exists(USER_DATA_F):
-        with open(USER_DATA_F, 'r', encoding='UTF8') as f:
-            reader = csv.reader(f)
-            header = next(reader)
-            v_users = valid_users()
-
-            # Scan through each row and complete the following:
-            # 1) Add user to users table if the username has not been encountered yet.
-            # 2) Extract the user id.
-            # 3) Find matching anime name from anime_data table, and extract the anime id.
-            # 4) Push the relevant information into user_data table.
-
-            for row in reader:
-                # Steps 1 and 2:
-                if row[0] not in v_users:
-                    continue
-                username = row[0]
-                user_id_query = select(users_table.columns.USER_ID).where(users_table.columns.USERNAME == username)
-                user_id_res = connection.execute(user_id_query).fetchone()
-                user_id = None
-
-                try:
-                    user_id = user_id_res[0]
-                except TypeError:
-                    res = connection.execute(users_table.insert(), {"USERNAME": username})
-                    user_id = res.lastrowid
-
-                # Step 3:
-                anime_title = row[1]
-                anime_id_query = select(anime_data_table.columns.ANIME_ID).where(anime_data_table.columns.ANIME_TITLE == anime_title)
-                anime_id_res = connection.execute(anime_id_query).fetchone()
-                anime_id = None if not anime_id_res else anime_id_res[0]
-
-                # Step 4:
-                entry = {"USER_ID": user_id, "ANIME_ID": anime_id, "WATCH_STATUS": row[4]}
-
-                if row[2] != "-":
-                    entry["SCORE"] = int(float(row[2]))
-                if row[3] != '-':
-                    entry["CURR_EPISODE"] = row[3]
-
-                connection.execute(user_data_table.insert(), entry)
-
-            f.close()
-
-def valid_users() -> Set[str]:
+        user_ids = {}
+        anime_ids = None
+
+        def write_user_batch(conn, batch: pd.DataFrame) -> None:
+            nonlocal anime_ids
+            # Look up anime ids once instead of per row.
+            if anime_ids is None:
+                anime_df = pd.DataFrame(conn.execute(select(anime_data_table.columns.ANIME_TITLE,
+                                                            anime_data_table.columns.ANIME_ID)
+                                                     .order_by(anime_data_table.columns.ANIME_ID)).fetchall(),
+                                        columns=["ANIME_TITLE", "ANIME_ID"])
+                anime_ids = anime_df.drop_duplicates(subset="ANIME_TITLE").set_index("ANIME_TITLE")["ANIME_ID"]
+
+            # Add users that have not been encountered yet, keeping the order they appear in.
+            usernames = [name for name in batch["USERNAME"].drop_duplicates() if name not in user_ids]
+            if usernames:
+                id_query = select(users_table.columns.USERNAME, users_table.columns.USER_ID)\
+                    .where(users_table.columns.USERNAME.in_(usernames))
+                user_ids.update(conn.execute(id_query).fetchall())
+                new_users = [{"USERNAME": name} for name in usernames if name not in user_ids]
+                if new_users:
+                    conn.execute(users_table.insert(), new_users)
+                    user_ids.update(conn.execute(id_query).fetchall())
+
+            entries = pd.DataFrame({"USER_ID": batch["USERNAME"].map(user_ids).astype("Int64"),
+                                    "ANIME_ID": batch["ANIME_TITLE"].map(anime_ids).astype("Int64"),
+                                    "SCORE": batch["SCORE"],
+                                    "CURR_EPISODE": batch["CURR_EPISODE"],
+                                    "WATCH_STATUS": batch["WATCH_STATUS"]})
+            conn.execute(user_data_table.insert(), to_db_rows(entries))
+
+        # The file is read once; rows stream to the writer as soon as their user is known to be valid.
+        write_batches(valid_user_batches(parse_chunks(USER_DATA_F, parse_user_chunk, workers)), write_user_batch,
+                      connection.engine)
+
+
+def status_bits(user_df: pd.DataFrame) -> pd.Series:
+    """
+    Encode which of VALID_STATUSES each user has, one bit per status.
+    :param user_df: DataFrame with USERNAME and WATCH_STATUS columns, as parsed from USER_DATA_F.
+    :return: Series mapping usernames to status bitmasks.
+    """
+    bits = user_df["WATCH_STATUS"].map({status: 1 << i for i, status in enumerate(VALID_STATUSES)})
+    bits = bits.fillna(0).astype(int)
+    return bits.groupby(user_df["USERNAME"].to_numpy()).agg(np.bitwise_or.reduce)
+
+
+def valid_user_batches(batches: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    """
+    Filter a stream of parsed USER_DATA_F batches down to rows of valid users (see valid_users).
+    Rows of users that do not qualify yet are held back per user until they do, and dropped if they never do.
+    :param batches: typed batches as returned by parse_user_chunk.
+    :return: iterator of batches containing only rows of valid users.
+    """
+    bits = {}
+    valid = set()
+    held = {}
+
+    for batch in batches:
+        batch_bits = status_bits(batch)
+        for name, user_bits in batch_bits.items():
+            bits[name] = bits.get(name, 0) | int(user_bits)
+        newly_valid = valid_users({name: bits[name] for name in batch_bits.index}) - valid
+        valid |= newly_valid
+
+        # Release held rows of users that just qualified, ahead of this batch's rows.
+        released = [rows for name in newly_valid for rows in held.pop(name, [])]
+
+        is_valid = batch["USERNAME"].isin(valid)
+        for name, rows in batch.loc[~is_valid].groupby("USERNAME", sort=False):
+            held.setdefault(name, []).append(rows)
+        yield pd.concat(released + [batch.loc[is_valid]])
+
+
+def valid_users(bits: Dict[str, int]) -> Set[str]:
     """
     Return a list of users with valid watch data (must have at least 2 of the following: watching/completed/dropped/onhold)
+    :param bits: mapping of usernames to status bitmasks, as returned by status_bits.
     :return: a set containing usernames of users with valid data.
     """
-    collected_users = set()
-    with open(USER_DATA_F, 'r', encoding='UTF8') as f:
-        reader = csv.reader(f)
-        header = next(reader)
-        for row in reader:
-            collected_users.add(row[0])
-        f.close()
-
-    df = pd.read_csv(USER_DATA_F)
-    for user in collected_users.copy():
-        user_df = df.loc[df["Username"] == user]
-        watching = user_df.loc[user_df["Watch_Status"] == "watching"].shape[0]
-        completed = user_df.loc[user_df["Watch_Status"] == "completed"].shape[0]
-        dropped = user_df.loc[user_df["Watch_Status"] == "dropped"].shape[0]
-        onhold = user_df.loc[user_df["Watch_Status"] == "onhold"].shape[0]
-
-        statuses = 0
-        if watching:
-            statuses = statuses + 1
-        if completed:
-            statuses = statuses + 1
-        if dropped:
-            statuses = statuses + 1
-        if onhold:
-            statuses = statuses + 1
-
-        if statuses < 2:
-            collected_users.remove(user)
-
-    return collected_users
+    return {name for name, user_bits in bits.items() if bin(int(user_bits)).count("1") >= MIN_VALID_STATUSES}
@@ -0,0 +1,126 @@
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+# Bayesian average settings: scores are pulled towards the global mean as if PRIOR_WEIGHT extra ratings were given.
+PRIOR_WEIGHT = 10
+
+# Statuses that do not count as having started the anime.
+UNSTARTED_STATUSES = ("plantowatch",)
+
+# Columns returned by recommend_popular.
+RESULT_COLUMNS = ["BAYES_SCORE", "MEAN_SCORE", "SCORE_COUNT", "COMPLETION_RATIO", "DROP_RATE"]
+
+# Running totals maintained by add_user_rows.
+SUM_COLUMNS = ["SCORE_SUM", "SCORE_COUNT", "COMPLETION_SUM", "COMPLETION_COUNT", "DROPPED_COUNT", "STARTED_COUNT"]
+
+
+def create_aggregates(anime_data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Create an empty aggregate store with one row per anime.
+    :param anime_data: DataFrame with ANIME_ID, ANIME_EPISODES, ANIME_GENRES and ANIME_PREMIERED columns.
+    :return: DataFrame indexed by ANIME_ID holding running totals, derived statistics and genre flags.
+    """
+    anime_data = anime_data.drop_duplicates(subset="ANIME_ID").set_index("ANIME_ID")
+    aggregates = pd.DataFrame(0.0, index=anime_data.index, columns=SUM_COLUMNS)
+    aggregates["ANIME_EPISODES"] = pd.to_numeric(anime_data["ANIME_EPISODES"], errors="coerce").to_numpy()
+    aggregates["ANIME_PREMIERED"] = anime_data["ANIME_PREMIERED"].astype("string").to_numpy()
+
+    # One boolean column per genre, so that filtering is a single column lookup.
+    genres = anime_data["ANIME_GENRES"].fillna("").astype(str).str.get_dummies(sep=", ").astype(bool)
+    aggregates[["GENRE_" + genre for genre in genres.columns]] = genres.to_numpy()
+
+    _refresh(aggregates)
+    return aggregates
+
+
+def add_user_rows(aggregates: pd.DataFrame, user_rows: pd.DataFrame) -> None:
+    """
+    Add new user_data rows to the running totals without rescanning earlier rows.
+    :param aggregates: aggregate store returned from create_aggregates, updated in place.
+    :param user_rows: DataFrame with ANIME_ID, SCORE, CURR_EPISODE and WATCH_STATUS columns.
+    :return: None
+    """
+    rows = user_rows.loc[user_rows["ANIME_ID"].isin(aggregates.index)]
+    episodes = aggregates["ANIME_EPISODES"].reindex(rows["ANIME_ID"]).to_numpy()
+    score = pd.to_numeric(rows["SCORE"], errors="coerce").to_numpy(dtype=float)
+    progress = pd.to_numeric(rows["CURR_EPISODE"], errors="coerce").to_numpy(dtype=float)
+    rated = score > 0
+    completion = np.clip(np.divide(progress, episodes, out=np.full(len(rows), np.nan), where=episodes > 0), 0, 1)
+    has_completion = ~np.isnan(completion)
+
+    # A missing status says nothing about whether the anime was started, so it counts towards neither total.
+    status = rows["WATCH_STATUS"].astype("string")
+    dropped = status.eq("dropped").to_numpy(dtype=bool, na_value=False)
+    started = (status.notna() & ~status.isin(UNSTARTED_STATUSES)).to_numpy(dtype=bool, na_value=False)
+
+    totals = pd.DataFrame({"SCORE_SUM": np.where(rated, score, 0),
+                           "SCORE_COUNT": rated,
+                           "COMPLETION_SUM": np.where(has_completion, completion, 0),
+                           "COMPLETION_COUNT": has_completion,
+                           "DROPPED_COUNT": dropped,
+                           "STARTED_COUNT": started},
+                          dtype=float).groupby(rows["ANIME_ID"].to_numpy()).sum()
+
+    aggregates.loc[totals.index, SUM_COLUMNS] += totals[SUM_COLUMNS]
+    _refresh(aggregates)
+
+
+def compute_aggregates(anime_data: pd.DataFrame, user_data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Compute per-anime statistics over all of user_data in one pass.
+    :param anime_data: DataFrame with ANIME_ID, ANIME_EPISODES, ANIME_GENRES and ANIME_PREMIERED columns.
+    :param user_data: DataFrame with ANIME_ID, SCORE, CURR_EPISODE and WATCH_STATUS columns.
+    :return: aggregate store, see create_aggregates.
+    """
+    aggregates = create_aggregates(anime_data)
+    add_user_rows(aggregates, user_data)
+    return aggregates
+
+
+def _refresh(aggregates: pd.DataFrame) -> None:
+    """
+    Recompute derived statistics from the running totals and keep the store sorted by BAYES_SCORE.
+    """
+    total_count = aggregates["SCORE_COUNT"].sum()
+    global_mean = aggregates["SCORE_SUM"].sum() / total_count if total_count else 0.0
+
+    aggregates["MEAN_SCORE"] = aggregates["SCORE_SUM"] / aggregates["SCORE_COUNT"].where(aggregates["SCORE_COUNT"] > 0)
+    aggregates["COMPLETION_RATIO"] = aggregates["COMPLETION_SUM"] / aggregates["COMPLETION_COUNT"]\
+        .where(aggregates["COMPLETION_COUNT"] > 0)
+    aggregates["DROP_RATE"] = aggregates["DROPPED_COUNT"] / aggregates["STARTED_COUNT"]\
+        .where(aggregates["STARTED_COUNT"] > 0)
+    # Unrated anime have no evidence of their own, so they get no score and sort after every rated one.
+    aggregates["BAYES_SCORE"] = ((PRIOR_WEIGHT * global_mean + aggregates["SCORE_SUM"])
+                                 / (PRIOR_WEIGHT + aggregates["SCORE_COUNT"])).where(aggregates["SCORE_COUNT"] > 0)
+
+    aggregates.sort_values(["BAYES_SCORE", "SCORE_COUNT"], ascending=False, inplace=True, kind="stable")
+
+
+def recommend_popular(aggregates: pd.DataFrame, n: int = 10, genre: Optional[str] = None,
+                      season: Optional[str] = None, exclude: Optional[Iterable[int]] = None) -> pd.DataFrame:
+    """
+    Return the n highest Bayesian-averaged anime, optionally restricted to a genre and/or premiered season.
+    Anime nobody in user_data has rated are never returned.
+    :param aggregates: aggregate store returned from create_aggregates or compute_aggregates.
+    :param n: number of anime to return.
+    :param genre: genre name as listed in ANIME_GENRES (e.g. "Action").
+    :param season: premiered season (e.g. "Spring 2022").
+    :param exclude: ANIME_IDs to leave out, e.g. anime already on the user's list.
+    :return: DataFrame indexed by ANIME_ID with RESULT_COLUMNS.
+    """
+    mask = (aggregates["SCORE_COUNT"] > 0).to_numpy(copy=True)
+    if genre is not None:
+        column = "GENRE_" + genre
+        if column not in aggregates.columns:
+            return aggregates.iloc[:0][RESULT_COLUMNS]
+        mask &= aggregates[column].to_numpy()
+    if season is not None:
+        mask &= (aggregates["ANIME_PREMIERED"] == season).fillna(False).to_numpy()
+    if exclude is not None:
+        mask &= ~aggregates.index.isin(list(exclude))
+
+    # The store is kept sorted, so the first n matching rows are the answer.
+    top = np.flatnonzero(mask)[:n]
+    return aggregates.iloc[top][RESULT_COLUMNS]
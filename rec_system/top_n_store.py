@@ -0,0 +1,338 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Define file locations.
+TOP_N_DIR = "top_n_output"
+TOP_N_RECORDS_F = "top_n_output/top_n_records.{generation}.npy"
+TOP_N_INDEX_F = "top_n_output/top_n_index.{generation}.npy"
+TOP_N_CURRENT_F = "top_n_output/CURRENT"
+
+# Batch settings.
+TOP_N = 50
+BLOCK_SIZE = 256
+UNWATCHED_STATUSES = ("plantowatch",)
+MIN_RATINGS = 5
+
+# Index layout: one entry per USER_ID, SLOT is the record row (-1 if the user has no record).
+INDEX_DTYPE = np.dtype([("SLOT", "<i8"), ("FINGERPRINT", "<u8")])
+
+# Matrices shared with the workers through read-only memmaps instead of being pickled into each process.
+SHARED_MATRICES = ["normalized", "centered", "rated", "watched"]
+
+# Shared worker state, set once per process by _init_worker.
+_WORKER_STATE = {}
+
+
+def record_dtype(n: int) -> np.dtype:
+    """
+    Fixed-width record layout holding a single user's top-n list.
+    :param n: number of recommendations stored per user.
+    :return: structured dtype with ANIME_ID and SCORE arrays of length n.
+    """
+    return np.dtype([("ANIME_ID", "<i4", (n,)), ("SCORE", "<f4", (n,))])
+
+
+def user_fingerprints(user_data: pd.DataFrame) -> pd.Series:
+    """
+    Hash each user's watch list so that changed inputs can be detected between runs.
+    :param user_data: DataFrame with USER_ID, ANIME_ID, SCORE and WATCH_STATUS columns.
+    :return: Series mapping USER_ID to an order-independent 64-bit fingerprint.
+    """
+    anime_ids = user_data["ANIME_ID"].to_numpy(dtype=np.uint64)
+    scores = user_data["SCORE"].fillna(-1).to_numpy(dtype=np.int64).astype(np.uint64)
+    statuses = pd.util.hash_array(user_data["WATCH_STATUS"].fillna("").to_numpy(dtype=object))
+
+    # Mix the fields of each row, then xor the row hashes of every user together.
+    row_hash = (anime_ids * np.uint64(0x9E3779B97F4A7C15)) ^ (scores * np.uint64(0xBF58476D1CE4E5B9)) ^ statuses
+    row_hash ^= row_hash >> np.uint64(31)
+    row_hash *= np.uint64(0x94D049BB133111EB)
+
+    user_ids = user_data["USER_ID"].to_numpy(dtype=np.int64)
+    order = np.argsort(user_ids, kind="stable")
+    unique_ids, starts = np.unique(user_ids[order], return_index=True)
+    return pd.Series(np.bitwise_xor.reduceat(row_hash[order], starts), index=unique_ids)
+
+
+def build_rating_matrix(user_data: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray,
+                                                           np.ndarray]:
+    """
+    Build dense user x anime matrices from user_data rows.
+    :param user_data: DataFrame with USER_ID, ANIME_ID, SCORE and WATCH_STATUS columns.
+    :return: (user_ids, anime_ids, normalized centered ratings, centered ratings, rated mask, watched mask).
+    """
+    user_ids, user_pos = np.unique(user_data["USER_ID"].to_numpy(dtype=np.int64), return_inverse=True)
+    anime_ids, anime_pos = np.unique(user_data["ANIME_ID"].to_numpy(dtype=np.int64), return_inverse=True)
+    shape = (len(user_ids), len(anime_ids))
+
+    scores = user_data["SCORE"].to_numpy(dtype=np.float32)
+    rated = ~np.isnan(scores) & (scores > 0)
+
+    ratings = np.zeros(shape, dtype=np.float32)
+    ratings[user_pos[rated], anime_pos[rated]] = scores[rated]
+    rated_mask = ratings > 0
+
+    watched = np.zeros(shape, dtype=bool)
+    on_list = ~user_data["WATCH_STATUS"].isin(UNWATCHED_STATUSES).to_numpy()
+    watched[user_pos[on_list], anime_pos[on_list]] = True
+
+    # Mean-center each user's ratings so that neighbours are compared on taste rather than scale.
+    counts = rated_mask.sum(axis=1)
+    means = np.divide(ratings.sum(axis=1), counts, out=np.zeros(shape[0], dtype=np.float32), where=counts > 0)
+    centered = np.where(rated_mask, ratings - means[:, None], 0).astype(np.float32)
+
+    norms = np.linalg.norm(centered, axis=1)
+    normalized = np.divide(centered, norms[:, None], out=np.zeros_like(centered), where=norms[:, None] > 0)
+
+    return user_ids, anime_ids, normalized, centered, rated_mask, watched
+
+
+def _init_worker(matrix_dir: str, anime_ids: np.ndarray, n: int, popularity: Optional[np.ndarray],
+                 cold: np.ndarray) -> None:
+    """
+    Map the shared matrices read-only into the worker process, so every worker uses the same pages.
+    """
+    _WORKER_STATE.update({name: np.load(os.path.join(matrix_dir, name + ".npy"), mmap_mode="r")
+                          for name in SHARED_MATRICES})
+    _WORKER_STATE.update(anime_ids=anime_ids, n=n, popularity=popularity, cold=cold)
+
+
+def _score_block(rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Score a block of users against every anime and select their top-n unwatched titles.
+    :param rows: matrix row positions of the users in this block.
+    :return: (rows, top anime ids, top scores).
+    """
+    normalized = _WORKER_STATE["normalized"]
+    centered = _WORKER_STATE["centered"]
+    rated = _WORKER_STATE["rated"]
+    anime_ids = _WORKER_STATE["anime_ids"]
+    n = _WORKER_STATE["n"]
+
+    # User-user cosine similarity, excluding each user from their own neighbourhood.
+    sim = normalized[rows] @ normalized.T
+    sim[np.arange(len(rows)), rows] = 0
+
+    # Anime without any neighbour evidence get no prediction rather than a neutral one.
+    weight = np.abs(sim) @ rated
+    scores = np.divide(sim @ centered, weight, out=np.full_like(weight, -np.inf), where=weight > 0)
+
+    # Users with too few ratings or no similar users have no meaningful neighbourhood, so fall back to the
+    # popularity ranking.
+    if _WORKER_STATE["popularity"] is not None:
+        cold = _WORKER_STATE["cold"][rows] | ~sim.any(axis=1)
+        scores[cold] = _WORKER_STATE["popularity"]
+    scores[_WORKER_STATE["watched"][rows]] = -np.inf
+
+    k = min(n, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+    out_ids = np.full((len(rows), n), -1, dtype=np.int32)
+    out_scores = np.full((len(rows), n), np.nan, dtype=np.float32)
+    valid = np.isfinite(top_scores)
+    out_ids[:, :k] = np.where(valid, anime_ids[top], -1)
+    out_scores[:, :k] = np.where(valid, top_scores, np.nan)
+
+    return rows, out_ids, out_scores
+
+
+def _current_generation() -> Optional[int]:
+    """
+    Read the generation of the store that readers should currently use.
+    :return: generation number, or None if no store has been written yet.
+    """
+    if not os.path.exists(TOP_N_CURRENT_F):
+        return None
+    with open(TOP_N_CURRENT_F, 'r') as f:
+        return int(f.read().strip())
+
+
+def _open_records(user_ids: np.ndarray, n: int, full: bool) -> Tuple[np.memmap, np.ndarray, int]:
+    """
+    Create the records file of the next generation, carrying over the current records unless every record is
+    about to be rewritten. The live files are never written to.
+    :param user_ids: every USER_ID that should have a record.
+    :param n: number of recommendations stored per user.
+    :param full: whether every record is about to be rewritten.
+    :return: (writable records memmap, index array, generation being written).
+    """
+    dtype = record_dtype(n)
+    current = _current_generation()
+    index = None
+    records = None
+
+    if current is not None:
+        index = np.load(TOP_N_INDEX_F.format(generation=current))
+        if not full:
+            records = np.load(TOP_N_RECORDS_F.format(generation=current), mmap_mode="r")
+            if records.dtype != dtype:
+                records, index = None, None
+
+    if index is None:
+        index = np.zeros(0, dtype=INDEX_DTYPE)
+
+    size = max(len(index), int(user_ids.max()) + 1)
+    if size > len(index):
+        grown = np.zeros(size, dtype=INDEX_DTYPE)
+        grown["SLOT"] = -1
+        grown[:len(index)] = index
+        index = grown
+
+    # Existing users keep their slots, new users are appended.
+    missing = user_ids[index["SLOT"][user_ids] < 0]
+    num_slots = int(index["SLOT"].max()) + 1 if len(index) else 0
+    index["SLOT"][missing] = np.arange(num_slots, num_slots + len(missing))
+
+    generation = 0 if current is None else current + 1
+    next_records = np.lib.format.open_memmap(TOP_N_RECORDS_F.format(generation=generation), mode="w+", dtype=dtype,
+                                             shape=(num_slots + len(missing),))
+    next_records["ANIME_ID"] = -1
+    next_records["SCORE"] = np.nan
+    if records is not None:
+        for start in range(0, len(records), BLOCK_SIZE * 16):
+            end = min(start + BLOCK_SIZE * 16, len(records))
+            next_records[start:end] = records[start:end]
+        del records
+    return next_records, index, generation
+
+
+def _publish(generation: int) -> None:
+    """
+    Point readers at a fully written generation, then remove generations older than the one it replaces.
+    :param generation: generation whose records and index files are complete.
+    :return: None
+    """
+    with open(TOP_N_CURRENT_F + ".tmp", 'w') as f:
+        f.write(str(generation))
+    os.replace(TOP_N_CURRENT_F + ".tmp", TOP_N_CURRENT_F)
+
+    # The previous generation is kept for readers that read the pointer just before the switch, and every
+    # older one was already removed by earlier runs.
+    if generation >= 2:
+        for file in (TOP_N_RECORDS_F, TOP_N_INDEX_F):
+            try:
+                os.remove(file.format(generation=generation - 2))
+            except OSError:
+                pass
+
+
+def build_top_n_store(user_data: pd.DataFrame, n: int = TOP_N, only_changed: bool = False,
+                      workers: Optional[int] = None, aggregates: Optional[pd.DataFrame] = None) -> int:
+    """
+    Score every user, keep their top-n unwatched anime, and write the results to the memory-mapped store.
+    Users are scored in blocks of BLOCK_SIZE across a process pool. Each run writes a new generation of the
+    records and index files and publishes both at once through TOP_N_CURRENT_F.
+    :param user_data: DataFrame with USER_ID, ANIME_ID, SCORE and WATCH_STATUS columns (see get_all_user_data).
+    :param n: number of recommendations stored per user.
+    :param only_changed: only rescore users whose watch list changed since the last run. Neighbours of a
+                         changed user keep their stored lists until the next full run. When aggregates
+                         is given, all cold-start users are rescored as well so their lists follow it.
+    :param workers: number of worker processes, defaults to the number of cores.
+    :param aggregates: aggregate store from popularity.py. Users with fewer than MIN_RATINGS ratings are
+                       given its BAYES_SCORE ranking instead of collaborative filtering scores.
+    :return: number of users written.
+    """
+    user_data = user_data.dropna(subset=["USER_ID", "ANIME_ID"])
+    if user_data.empty:
+        return 0
+    user_ids, anime_ids, normalized, centered, rated, watched = build_rating_matrix(user_data)
+    fingerprints = user_fingerprints(user_data).reindex(user_ids).to_numpy(dtype=np.uint64)
+    # Users with fewer than MIN_RATINGS actual ratings, or whose ratings are all the same value (and so
+    # have no direction to compare against), are cold-start users.
+    cold = (rated.sum(axis=1) < MIN_RATINGS) | ~normalized.any(axis=1)
+    popularity = None
+    if aggregates is not None:
+        # Unrated anime have no BAYES_SCORE and are left out of the fallback.
+        popularity = aggregates["BAYES_SCORE"].reindex(anime_ids).fillna(-np.inf).to_numpy(dtype=np.float32)
+
+    os.makedirs(TOP_N_DIR, exist_ok=True)
+    records, index, generation = _open_records(user_ids, n, full=not only_changed)
+
+    # Determine which matrix rows need to be rescored.
+    if only_changed:
+        stale = index["FINGERPRINT"][user_ids] != fingerprints
+        if popularity is not None:
+            stale |= cold
+        rows = np.flatnonzero(stale)
+    else:
+        rows = np.arange(len(user_ids))
+
+    blocks = [rows[start:start + BLOCK_SIZE] for start in range(0, len(rows), BLOCK_SIZE)]
+    with tempfile.TemporaryDirectory() as matrix_dir:
+        # rated is stored as float32 so that the weight product does not convert it in every block.
+        shared = {"normalized": normalized, "centered": centered, "rated": rated.astype(np.float32), "watched": watched}
+        for name in SHARED_MATRICES:
+            np.save(os.path.join(matrix_dir, name + ".npy"), shared[name])
+        del shared, normalized, centered, rated, watched
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(matrix_dir, anime_ids, n, popularity, cold)) as pool:
+            for block_rows, top_ids, top_scores in pool.map(_score_block, blocks):
+                slots = index["SLOT"][user_ids[block_rows]]
+                records["ANIME_ID"][slots] = top_ids
+                records["SCORE"][slots] = top_scores
+
+    records.flush()
+    del records
+
+    # Records and index are both complete before the pointer moves, so readers always get a matching pair.
+    index["FINGERPRINT"][user_ids[rows]] = fingerprints[rows]
+    np.save(TOP_N_INDEX_F.format(generation=generation), index)
+    _publish(generation)
+
+    return len(rows)
+
+
+def load_top_n_store() -> Optional[Tuple[np.memmap, np.memmap]]:
+    """
+    Open the current generation of the top-n store read-only. Safe to call from any number of processes.
+    Builds never modify a published generation, so call this again to pick up newer results.
+    :return: (records memmap, index memmap), or None if no store has been published yet.
+    """
+    generation = _current_generation()
+    if generation is None:
+        return None
+    return (np.load(TOP_N_RECORDS_F.format(generation=generation), mmap_mode="r"),
+            np.load(TOP_N_INDEX_F.format(generation=generation), mmap_mode="r"))
+
+
+def get_top_n(records: np.memmap, index: np.memmap, user_id: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Look up a user's stored recommendations in constant time. The returned arrays are views into the
+    memory-mapped file, unused trailing entries have ANIME_ID -1.
+    :param records: records memmap returned from load_top_n_store.
+    :param index: index memmap returned from load_top_n_store.
+    :param user_id: USER_ID from users table.
+    :return: (anime ids, scores), or None if the user has no stored recommendations.
+    """
+    if user_id < 0 or user_id >= len(index):
+        return None
+    slot = index["SLOT"][user_id]
+    if slot < 0:
+        return None
+    record = records[slot]
+    return record["ANIME_ID"], record["SCORE"]
+
+
+if __name__ == "__main__":
+    from db.connection import get_db_connection
+    from db.query import get_all_anime_data, get_all_user_data
+    from rec_system.popularity import compute_aggregates
+
+    engine, conn, meta_data = get_db_connection()
+    df = pd.DataFrame(get_all_user_data(conn, meta_data),
+                      columns=["USER_ID", "ANIME_ID", "SCORE", "CURR_EPISODE", "WATCH_STATUS"])
+    anime_df = pd.DataFrame(get_all_anime_data(conn, meta_data),
+                            columns=["ANIME_ID", "ANIME_TITLE", "ANIME_SHOW_TYPE", "ANIME_EPISODES", "ANIME_PREMIERED",
+                                     "ANIME_SOURCE", "ANIME_STUDIOS", "ANIME_GENRES", "ANIME_THEMES",
+                                     "ANIME_AGE_RATING", "ANIME_SCORE", "ANIME_RANKING", "ANIME_POPULARITY"])
+    written = build_top_n_store(df, only_changed=True, aggregates=compute_aggregates(anime_df, df))
+    print(f"Wrote recommendations for {written} users.")
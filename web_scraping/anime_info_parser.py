@@ -0,0 +1,103 @@
+import re
+from typing import List, Optional, Tuple
+
+import pandas as pd
+
+# Map labels on the anime page (and headers of ANIME_DATA_F) to anime_data columns.
+LABEL_COLUMNS = {"Type": "ANIME_SHOW_TYPE", "Episodes": "ANIME_EPISODES", "Aired": "ANIME_PREMIERED",
+                 "Studios": "ANIME_STUDIOS", "Source": "ANIME_SOURCE", "Genre": "ANIME_GENRES",
+                 "Genres": "ANIME_GENRES", "Theme": "ANIME_THEMES", "Themes": "ANIME_THEMES",
+                 "Rating": "ANIME_AGE_RATING", "Score": "ANIME_SCORE", "Ranked": "ANIME_RANKING",
+                 "Popularity": "ANIME_POPULARITY"}
+CSV_COLUMNS = {"title": "ANIME_TITLE", "show_type": "ANIME_SHOW_TYPE", "episodes": "ANIME_EPISODES",
+               "premiered": "ANIME_PREMIERED", "studios": "ANIME_STUDIOS", "source": "ANIME_SOURCE",
+               "genres": "ANIME_GENRES", "theme": "ANIME_THEMES", "age_rating": "ANIME_AGE_RATING",
+               "score": "ANIME_SCORE", "ranking": "ANIME_RANKING", "popularity_rank": "ANIME_POPULARITY"}
+COLUMNS = ["ANIME_TITLE", "ANIME_SHOW_TYPE", "ANIME_EPISODES", "ANIME_PREMIERED", "ANIME_SOURCE", "ANIME_STUDIOS",
+           "ANIME_GENRES", "ANIME_THEMES", "ANIME_AGE_RATING", "ANIME_SCORE", "ANIME_RANKING", "ANIME_POPULARITY"]
+NUMERIC_COLUMNS = {"ANIME_EPISODES": "Int64", "ANIME_SCORE": "Float64", "ANIME_RANKING": "Int64",
+                   "ANIME_POPULARITY": "Int64"}
+
+# Placeholders MAL uses for missing values.
+MISSING_VALUES = ["", "Unknown", "N/A", "None", "None found, add some"]
+
+# Precompiled patterns for numeric fields and air dates.
+NUMBER_RE = re.compile(r"^\s*#?(\d+(?:\.\d+)?)")
+AIRED_RE = re.compile(r"^(?P<month>[A-Z][a-z]{2})[a-z]*\.?\s+(?:\d{1,2},\s*)?(?P<year>\d{4})")
+PREMIERED_RE = re.compile(r"^(?:Winter|Spring|Summer|Fall) \d{4}$")
+
+# Month -> (season, year offset). December counts towards the following winter.
+MONTH_SEASONS = {"Jan": ("Winter", 0), "Feb": ("Winter", 0), "Mar": ("Spring", 0), "Apr": ("Spring", 0),
+                 "May": ("Spring", 0), "Jun": ("Summer", 0), "Jul": ("Summer", 0), "Aug": ("Summer", 0),
+                 "Sep": ("Fall", 0), "Oct": ("Fall", 0), "Nov": ("Fall", 0), "Dec": ("Winter", 1)}
+
+
+def aired_to_premiered(aired: pd.Series) -> pd.Series:
+    """
+    Convert "Aired" strings (e.g. "Apr 6, 2022 to Jun 25, 2022") to premiered seasons (e.g. "Spring 2022").
+    Values that are already a premiered season are kept as is.
+    :param aired: Series of raw aired strings.
+    :return: Series of premiered seasons, <NA> where the start date could not be parsed.
+    """
+    aired = aired.astype("string")
+    parts = aired.str.extract(AIRED_RE)
+    season = parts["month"].map({month: s for month, (s, _) in MONTH_SEASONS.items()}).astype("string")
+    offset = parts["month"].map({month: o for month, (_, o) in MONTH_SEASONS.items()}).astype("Int64")
+    year = pd.to_numeric(parts["year"], errors="coerce").astype("Int64") + offset
+
+    premiered = season + " " + year.astype("string")
+    return premiered.where(~aired.str.match(PREMIERED_RE).fillna(False), aired)
+
+
+def normalize_anime_data(raw: pd.DataFrame) -> pd.DataFrame:
+    """
+    Parse raw string columns (named as in anime_data) into typed columns.
+    :param raw: DataFrame of unparsed strings, missing columns are treated as unknown.
+    :return: DataFrame with COLUMNS, where numeric fields are nullable Int64/Float64 and text fields are strings.
+    """
+    df = raw.reindex(columns=COLUMNS).astype("string")
+    df = df.apply(lambda col: col.str.strip()).mask(lambda frame: frame.isin(MISSING_VALUES))
+
+    df["ANIME_PREMIERED"] = aired_to_premiered(df["ANIME_PREMIERED"])
+    for column, dtype in NUMERIC_COLUMNS.items():
+        digits = df[column].str.replace(",", "", regex=False).str.extract(NUMBER_RE)[0]
+        df[column] = pd.to_numeric(digits, errors="coerce").astype(dtype)
+
+    return df
+
+
+def normalize_info_pairs(pairs: List[List[Tuple[str, str]]], titles: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Parse a batch of scraped anime pages given as (label, content) pairs into typed columns.
+    :param pairs: one list of (label, content) pairs per anime, unrecognized labels are ignored.
+    :param titles: optional anime titles, in the same order as pairs.
+    :return: typed DataFrame as returned by normalize_anime_data, one row per anime.
+    """
+    long = pd.DataFrame([(i, label, content) for i, page in enumerate(pairs) for label, content in page],
+                        columns=["ROW", "LABEL", "CONTENT"])
+    long["COLUMN"] = long["LABEL"].map(LABEL_COLUMNS)
+    long = long.dropna(subset=["COLUMN"]).drop_duplicates(subset=["ROW", "COLUMN"], keep="last")
+
+    raw = long.pivot(index="ROW", columns="COLUMN", values="CONTENT").reindex(range(len(pairs))).rename_axis(columns=None)
+    if titles is not None:
+        raw["ANIME_TITLE"] = titles
+    return normalize_anime_data(raw).reset_index(drop=True)
+
+
+def read_anime_data(file: str) -> pd.DataFrame:
+    """
+    Read an existing anime data csv file into typed columns.
+    :param file: path to a csv file in the format of ANIME_DATA_F.
+    :return: typed DataFrame as returned by normalize_anime_data.
+    """
+    raw = pd.read_csv(file, dtype=str, keep_default_na=False, encoding="utf-8")
+    return normalize_anime_data(raw.rename(columns=CSV_COLUMNS))
+
+
+def to_db_rows(df: pd.DataFrame) -> List[dict]:
+    """
+    Convert a typed DataFrame into insertable rows, replacing missing values with None.
+    :param df: typed DataFrame.
+    :return: list of dicts keyed by column name.
+    """
+    return df.astype(object).where(df.notna(), None).to_dict("records")
@@ -4,10 +4,12 @@ import time
 from typing import List
 from pathlib import Path
 
+import pandas as pd
 from selenium.webdriver.common.by import By
 from selenium.webdriver.remote.webelement import WebElement
 from selenium.common.exceptions import NoSuchElementException
 
+from web_scraping.anime_info_parser import CSV_COLUMNS, normalize_info_pairs
 from web_scraping.scraper_utils import get_driver, navigate_to, remove_cookies_popup
 
 # Define constants.
@@ -43,70 +45,17 @@ def parse_anime_info(info: List[WebElement]) -> List[str]:
     """
     Parse all anime info from extracted webelements.
     :param info: list of webelements from anime webpage.
-    :return: anime_info as a single string, delimited by ','.
+    :return: anime_info as a list of strings, in the column order of ANIME_DATA_F.
     """
-    show_type = ""
-    episodes = ""
-    premiered = ""
-    studios = ""
-    source = ""
-    genres = ""
-    theme = ""
-    age_rating = ""
-    score = ""
-    ranking = ""
-    popularity_rank = ""
-
+    pairs = []
     for element in info:
-        text = element.text
-        if len(text) == 0:
-            continue
-        text = text.split(": ")
-        if len(text) < 2:
-            continue
-        label, content = text[0], text[1]
-
-        if label == "Type":
-            show_type = content
-        elif label == "Episodes":
-            episodes = content
-        elif label == "Aired":
-            try:
-                start_month = content[0:4]
-                split_mt_yr = content.split(", ") if len(content.split(", ")) > 0 else content.split(" ")
-                start_year = split_mt_yr[1]
-
-                if start_month.startswith("Jan") or start_month.startswith("Feb"):
-                    premiered = "Winter " + start_year[0:4]
-                elif start_month.startswith("Mar") or start_month.startswith("Apr") or start_month.startswith("May"):
-                    premiered = "Spring " + start_year[0:4]
-                elif start_month.startswith("Jun") or start_month.startswith("Jul") or start_month.startswith("Aug"):
-                    premiered = "Summer " + start_year[0:4]
-                elif start_month.startswith("Sep") or start_month.startswith("Oct") or start_month.startswith("Nov"):
-                    premiered = "Fall " + start_year[0:4]
-                elif start_month.startswith("Dec"):
-                    premiered = "Winter " + str(int(start_year[0:4]) + 1)
-            except IndexError:
-                continue
-        elif label == "Studios":
-            studios = content
-        elif label == "Source":
-            source = content
-        elif label == "Genre" or label == "Genres":
-            genres = content
-        elif label == "Theme" or label == "Themes":
-            theme = content
-        elif label == "Rating":
-            age_rating = content
-        elif label == "Score":
-            score = content.split(" ")[0]
-        elif label == "Ranked":
-            ranking = content.split("#")[1]
-        elif label == "Popularity":
-            popularity_rank = content.split("#")[1]
+        text = element.text.split(": ", 1)
+        if len(text) == 2:
+            pairs.append((text[0], text[1]))
 
     # show_type,episodes,premiered,studios,source,genres,theme,age_rating,score,ranking,popularity_rank
-    parsed_info = [show_type, episodes, premiered, studios, source, genres, theme, age_rating, score, ranking, popularity_rank]
+    parsed = normalize_info_pairs([pairs]).iloc[0]
+    parsed_info = ["" if pd.isna(parsed[column]) else str(parsed[column]) for column in list(CSV_COLUMNS.values())[1:]]
 
     return parsed_info
 